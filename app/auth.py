@@ -1,5 +1,8 @@
+import hashlib
 import secrets
+import threading
 from typing import Annotated
+from cachetools import TTLCache
 from fastapi import Depends, HTTPException
 
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
@@ -11,6 +14,25 @@ from app.models import User
 
 security = HTTPBasic()
 
+_credentialsCache = TTLCache(maxsize=10000, ttl=60)
+_credentialsLock = threading.Lock()
+
+
+def verify_password(username, password, hashed_password):
+    key = (username, hashlib.sha256(password.encode()).digest())
+
+    with _credentialsLock:
+        cached = _credentialsCache.get(key)
+    if cached is not None and secrets.compare_digest(cached, hashed_password):
+        return True
+
+    if not pwd_context.verify(password, hashed_password):
+        return False
+
+    with _credentialsLock:
+        _credentialsCache[key] = hashed_password
+    return True
+
 
 def get_current_username(
     credentials: HTTPBasicCredentials = Depends(security),
@@ -20,8 +42,8 @@ def get_current_username(
 
     if user is not None:
         is_correct_username = credentials.username == user.username
-        is_correct_password = pwd_context.verify(
-            credentials.password, user.hashed_password)
+        is_correct_password = verify_password(
+            credentials.username, credentials.password, user.hashed_password)
     else:
         is_correct_username = False
         is_correct_password = False
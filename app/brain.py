@@ -1,10 +1,13 @@
+import asyncio
 import gc
+import os
 import threading
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from concurrent.futures import ThreadPoolExecutor
 from langchain.prompts import PromptTemplate
 from langchain.chains import ConversationalRetrievalChain, LLMChain
 from langchain.agents import initialize_agent, load_tools
 import torch
+from app.cache import ModelCache
 from app.llm_tools import DalleImage, StableDiffusionImage
 from app.llms.llava import LlavaLLM
 from app.llms.loader import localLoader
@@ -12,7 +15,8 @@ from app.model import Model
 
 from app.models import ProjectModel, ProjectModelUpdate, QuestionModel, ChatModel, VisionModel
 from app.project import Project
-from app.vectordb import vector_init
+from app.tools import InvalidateEmbeddingsPath
+from app.vectordb import vector_init, vector_retriever, vector_search
 from modules.embeddings import EMBEDDINGS
 from modules.llms import LLMS
 from app.database import dbc
@@ -23,17 +27,26 @@ from modules.prompts import PROMPTS
 
 class Brain:
     def __init__(self):
-        self.projects = []
-        self.llmCache = {}
-        self.embeddingCache = {}
+        self.projects = {}
+        cacheSize = int(os.environ.get("MODEL_CACHE_SIZE", "4"))
+        pinned = {m for m in os.environ.get("MODEL_CACHE_PINNED", "").split(",") if m}
+        self.llmCache = ModelCache(cacheSize, lambda: pinned)
+        # Loaded projects' vectorstores hold their embeddings, evicting those would only duplicate them.
+        # So this cache only bounds embeddings no project uses: their memory is released by deleting
+        # the project (projects stay loaded until then), not by MODEL_CACHE_SIZE.
+        self.embeddingCache = ModelCache(cacheSize, lambda: pinned | {
+            project.model.embeddings for project in list(self.projects.values())})
         self.defaultCensorship = "This question is outside of my scope. Please ask another question."
         self.defaultNegative = "I'm sorry, I don't know the answer to that."
         self.defaultSystem = ""
-        self.loopFailsafe = 0
+        self.maxRecursion = 10
+        self.maxQuestions = int(os.environ.get("QUESTIONS_MAX", "32"))
+        self.questionsConcurrency = int(os.environ.get("QUESTIONS_CONCURRENCY", "4"))
         self.semaphore = threading.BoundedSemaphore()
+        self.loaderExecutor = ThreadPoolExecutor(thread_name_prefix="llm-loader")
 
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            separators=[" "], chunk_size=1024, chunk_overlap=30)
+        self.chunkSize = 1024
+        self.chunkOverlap = 30
         
     def memoryModelsInfo(self):
         models = []
@@ -86,8 +99,9 @@ class Brain:
 
     def getLLM(self, llmModel, **kwargs):
         new = False
-        if llmModel in self.llmCache:
-            return self.llmCache[llmModel], False
+        m = self.llmCache.get(llmModel)
+        if m is not None:
+            return m, False
         else:
             new = True
             self.semaphore.acquire()
@@ -120,22 +134,28 @@ class Brain:
             else:
                 raise Exception("Invalid LLM type.")
 
+    async def loadLLM(self, llmModel):
+        # getLLM may block on the semaphore, keep it off the default executor
+        # that LangChain uses to run synchronous LLMs.
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.loaderExecutor, self.getLLM, llmModel)
+
     def getEmbedding(self, embeddingModel):
-        if embeddingModel in self.embeddingCache:
-            return self.embeddingCache[embeddingModel]
+        model = self.embeddingCache.get(embeddingModel)
+        if model is not None:
+            return model
         else:
             if embeddingModel in EMBEDDINGS:
                 embedding_class, embedding_args, privacy, description = EMBEDDINGS[embeddingModel]
                 model = embedding_class(**embedding_args)
-                self.embeddingCache[embeddingModel] = model
-                return model
+                return self.embeddingCache.setdefault(embeddingModel, model)
             else:
                 raise Exception("Invalid Embedding type.")
 
     def findProject(self, name, db):
-        for project in self.projects:
-            if project.model.name == name:
-                return project
+        project = self.projects.get(name)
+        if project is not None:
+            return project
 
         p = dbc.get_project_by_name(db, name)
         if p is None:
@@ -145,7 +165,7 @@ class Brain:
             project = Project()
             project.model = proj
             project.db = vector_init(self, project)
-            self.projects.append(project)
+            self.projects[project.model.name] = project
             return project
 
     def createProject(self, projectModel, db):
@@ -159,10 +179,11 @@ class Brain:
             projectModel.censorship,
             projectModel.vectorstore,
         )
+        InvalidateEmbeddingsPath(projectModel.name)
         project = Project()
         project.boot(projectModel)
         project.db = vector_init(self, project)
-        self.projects.append(project)
+        self.projects[project.model.name] = project
         return project
 
     def editProject(self, name, projectModel: ProjectModelUpdate, db):
@@ -214,63 +235,63 @@ class Brain:
         return project
 
     def deleteProject(self, name, db):
-        self.findProject(name, db)
-        dbc.delete_project(db, dbc.get_project_by_name(db, name))
         proj = self.findProject(name, db)
-        if proj is not None:
-            proj.delete()
-            self.projects.remove(proj)
+        proj_db = dbc.get_project_by_name(db, name)
+        if proj is None or proj_db is None:
+            return False
+
+        proj.delete()
+        dbc.delete_project(db, proj_db)
+        self.projects.pop(name, None)
         return True
 
-    def entryChat(self, projectName: str, input: ChatModel, db: Session):
-        self.loopFailsafe = 0
-        chat, output = self.recursiveChat(projectName, input, db)
+    async def entryChat(self, projectName: str, input: ChatModel, db: Session):
+        chat, output = await self.recursiveChat(projectName, input, db)
         chat.history.append((input.question, output["answer"]))
         return chat, output
 
-    def recursiveChat(
+    async def recursiveChat(
             self,
             projectName: str,
             input: ChatModel,
             db: Session,
-            chatR=None):
-        project = self.findProject(projectName, db)
+            chatR=None,
+            depth=0):
+        project = await asyncio.to_thread(self.findProject, projectName, db)
         if chatR:
             chat = chatR
             questionInput = QuestionModel(
                 question=input.question,
             )
-            answer, docs, censored = self.questionContext(
+            answer, docs, censored = await self.questionContext(
                 project, questionInput)
             output = {"source_documents": docs, "answer": answer}
         else:
-            chat, output, censored = self.chat(project, input)
+            chat, output, censored = await self.chat(project, input)
 
         if censored:
-            projectc = self.findProject(project.model.sandbox_project, db)
+            projectc = await asyncio.to_thread(self.findProject, project.model.sandbox_project, db)
             if projectc is not None:
-                if self.loopFailsafe >= 10:
+                if depth >= self.maxRecursion:
                     return chat, {"source_documents": [],
                                   "answer": self.defaultNegative}
-                self.loopFailsafe += 1
-                chat, output = self.recursiveChat(
-                    project.model.sandbox_project, input, db, chat)
+                chat, output = await self.recursiveChat(
+                    project.model.sandbox_project, input, db, chat, depth + 1)
 
         return chat, output
 
-    def chat(self, project, chatModel):
-        model, loaded = self.getLLM(project.model.llm)
+    async def chat(self, project, chatModel):
+        model, loaded = await self.loadLLM(project.model.llm)
         chat = project.loadChat(chatModel)
 
-        retriever = project.db.as_retriever(
-            search_type="similarity_score_threshold",
-            search_kwargs={
-                "score_threshold": chatModel.score or project.model.score or 0.2,
-                "k": chatModel.k or project.model.k or 1})
+        retriever = vector_retriever(
+            project,
+            chatModel.k or project.model.k or 1,
+            chatModel.score or project.model.score or 0.2)
         
         try:
-            docs = retriever.get_relevant_documents(chatModel.question)
-        except BaseException:
+            docs = await retriever.aget_relevant_documents(chatModel.question)
+        except Exception:
             docs = []
             
         if len(docs) == 0:
@@ -295,7 +316,7 @@ class Brain:
             combine_docs_chain_kwargs={
                 "prompt": custom_prompt})
 
-        result = conversationalChain(
+        result = await conversationalChain.acall(
             {"question": chatModel.question, "chat_history": chat.history}
         )
         
@@ -308,36 +329,87 @@ class Brain:
 
         return chat, result, False
 
-    def entryQuestion(
+    async def entryQuestion(
             self,
             projectName: str,
             input: QuestionModel,
             db: Session):
-        self.loopFailsafe = 0
-        return self.recursiveQuestion(projectName, input, db)
+        return await self.recursiveQuestion(projectName, input, db)
+
+    async def entryQuestions(
+            self,
+            projectName: str,
+            inputs: list[QuestionModel],
+            db: Session):
+        if len(inputs) == 0:
+            return []
+
+        project = await asyncio.to_thread(self.findProject, projectName, db)
+
+        # Warm the model once, but don't hold the semaphore while answering: a censored
+        # question may fall back to a sandbox project that needs to load another model.
+        model, loaded = await self.loadLLM(project.model.llm)
+        if loaded == True:
+            self.semaphore.release()
+
+        ks = [input.k or project.model.k or 1 for input in inputs]
+        try:
+            batches = await asyncio.to_thread(
+                vector_search, project, [input.question for input in inputs], max(ks))
+        except Exception:
+            batches = [[] for _ in inputs]
 
-    def recursiveQuestion(
+        retrieved = []
+        for input, k, batch in zip(inputs, ks, batches):
+            threshold = input.score or project.model.score or 0.2
+            retrieved.append(
+                [doc for doc, score in batch[:k] if score >= threshold])
+
+        slots = asyncio.Semaphore(self.questionsConcurrency)
+
+        async def answer(input, docs):
+            async with slots:
+                return await self.recursiveQuestion(projectName, input, db, docs=docs)
+
+        return await asyncio.gather(*[answer(input, docs) for input, docs in zip(inputs, retrieved)])
+
+    async def recursiveQuestion(
             self,
             projectName: str,
             input: QuestionModel,
             db: Session,
-            recursive=False):
-        project = self.findProject(projectName, db)
-        answer, docs, censored = self.questionContext(
-            project, input, recursive)
+            recursive=False,
+            docs=None,
+            depth=0):
+        project = await asyncio.to_thread(self.findProject, projectName, db)
+        answer, docs, censored = await self.questionContext(
+            project, input, recursive, docs)
         if censored:
-            projectc = self.findProject(project.model.sandbox_project, db)
+            projectc = await asyncio.to_thread(self.findProject, project.model.sandbox_project, db)
             if projectc is not None:
-                if self.loopFailsafe >= 10:
+                if depth >= self.maxRecursion:
                     return self.defaultNegative, []
-                self.loopFailsafe += 1
-                answer, docs = self.recursiveQuestion(
-                    project.model.sandbox_project, input, db, True)
+                answer, docs = await self.recursiveQuestion(
+                    project.model.sandbox_project, input, db, True, depth=depth + 1)
 
         return answer, docs
 
-    def questionContext(self, project, questionModel, child=False):
-        model, loaded = self.getLLM(project.model.llm)
+    async def questionContext(self, project, questionModel, child=False, docs=None):
+        if docs is None:
+            retriever = vector_retriever(
+                project,
+                questionModel.k or project.model.k or 1,
+                questionModel.score or project.model.score or 0.2)
+
+            try:
+                docs = await retriever.aget_relevant_documents(questionModel.question)
+            except Exception:
+                docs = []
+
+        if len(docs) == 0 and project.model.sandboxed:
+            return project.model.censorship or self.defaultCensorship, [], True
+
+        model, loaded = await self.loadLLM(project.model.llm)
 
         prompt_template_txt = PROMPTS[model.prompt]
 
@@ -345,22 +417,13 @@ class Brain:
             sysTemplate = project.model.system or self.defaultSystem
         else:
             sysTemplate = questionModel.system or project.model.system or self.defaultSystem
-
-        retriever = project.db.as_retriever(
-            search_type="similarity_score_threshold",
-            search_kwargs={
-                "score_threshold": questionModel.score or project.model.score or 0.2,
-                "k": questionModel.k or project.model.k or 1})
-
-        try:
-            docs = retriever.get_relevant_documents(questionModel.question)
-        except BaseException:
-            docs = []
             
         if len(docs) == 0:
             contextsub = ""
+            context = ""
         else:
             contextsub = "Context: {context}"
+            context = "\n\n---\n\n".join(doc.page_content for doc in docs)
 
         prompt_template = prompt_template_txt.format(
             system=sysTemplate, history="", context=contextsub)
@@ -370,24 +433,13 @@ class Brain:
         )
         chain = LLMChain(llm=model.llm, prompt=prompt)
 
-        if len(docs) == 0:
-            if project.model.sandboxed:
-                if loaded == True:
-                    self.semaphore.release()
-                return project.model.censorship or self.defaultCensorship, [], True
-            else:
-                inputs = [{"context": "",
-                           "question": questionModel.question}]
-        else:
-            inputs = [{"context": doc.page_content,
-                       "question": questionModel.question} for doc in docs]
-
-        output = chain.apply(inputs)
+        output = await chain.ainvoke(
+            {"context": context, "question": questionModel.question})
         
         if loaded == True:
             self.semaphore.release()
             
-        return output[0]["text"].strip(), docs, False
+        return output["text"].strip(), docs, False
 
     def entryVision(self, projectName, visionInput, db: Session):
         image  = None
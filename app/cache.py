@@ -0,0 +1,74 @@
+import gc
+from collections import OrderedDict
+import threading
+import torch
+
+
+class ModelCache:
+    def __init__(self, maxsize, pinned=lambda: ()):
+        self.maxsize = maxsize
+        self.pinned = pinned
+        self.models = OrderedDict()
+        self.lock = threading.RLock()
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.models
+
+    def __getitem__(self, key):
+        with self.lock:
+            self.models.move_to_end(key)
+            return self.models[key]
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            evicted = self.insert(key, value)
+        self.release(evicted)
+
+    def __delitem__(self, key):
+        with self.lock:
+            del self.models[key]
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.models:
+                return default
+            return self[key]
+
+    def setdefault(self, key, value):
+        evicted = []
+        with self.lock:
+            if key not in self.models:
+                evicted = self.insert(key, value)
+            value = self.models[key]
+        self.release(evicted)
+        return value
+
+    def items(self):
+        with self.lock:
+            return list(self.models.items())
+
+    def insert(self, key, value):
+        self.models[key] = value
+        self.models.move_to_end(key)
+        return self.evict(key)
+
+    def evict(self, newest):
+        # Pinned models and the one just added are never evicted, even if that leaves the cache above maxsize.
+        # Evicted models are only dropped from the cache, a caller still using one keeps it alive.
+        pinned = set(self.pinned()) | {newest}
+        excess = len(self.models) - self.maxsize
+        if excess <= 0:
+            return []
+
+        evicted = [key for key in self.models if key not in pinned][:excess]
+        for key in evicted:
+            print("EVICTING MODEL " + key)
+            del self.models[key]
+        return evicted
+
+    def release(self, evicted):
+        # Called without the lock held, a full gc pass shouldn't block other lookups.
+        if len(evicted) > 0:
+            gc.collect()
+            torch.cuda.empty_cache()
@@ -0,0 +1,20 @@
+import yake
+
+# Runs inside the keyword worker processes, so it must only import yake:
+# anything imported here is loaded again by every spawned worker.
+
+_kw_extractor = None
+
+
+def initKeywordExtractor():
+    global _kw_extractor
+    max_ngram_size = 4
+    numOfKeywords = 15
+    _kw_extractor = yake.KeywordExtractor(n=max_ngram_size, top=numOfKeywords)
+
+
+def extractKeywords(text):
+    if _kw_extractor is None:
+        initKeywordExtractor()
+    keywords = _kw_extractor.extract_keywords(text)
+    return "".join(kw[0] + ", " for kw in keywords)
@@ -22,10 +22,10 @@ from app.databasemodels import UserDatabase
 import urllib.parse
 
 from app.models import ChatResponse, EmbeddingModel, HardwareInfo, ProjectInfo, ProjectModel, ProjectModelUpdate, QuestionModel, ChatModel, QuestionResponse, TextIngestModel, URLIngestModel, User, UserCreate, UserUpdate, VisionModel
-from app.tools import FindFileLoader, IndexDocuments, ExtractKeywordsForMetadata, get_logger, loadEnvVars
+from app.tools import FindFileLoader, ExtractKeywordsForMetadata, get_logger, loadEnvVars
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from app.vectordb import vector_delete_source, vector_delete_id, vector_find, vector_info, vector_init, vector_reset, vector_save, vector_list
+from app.vectordb import IndexDocuments, vector_delete_source, vector_delete_id, vector_find, vector_info, vector_init, vector_reset, vector_save, vector_list
 from langchain_core.documents import Document
 
 from modules.embeddings import EMBEDDINGS
@@ -570,6 +570,33 @@ def delete_file(
     return {"deleted": len(ids)}
 
 
+def questionOutput(user, input, answer, docs):
+    sources = [{"content": doc.page_content,
+                "keywords": doc.metadata.get("keywords", ""),
+                "source": doc.metadata.get("source", "")} for doc in docs]
+
+    output = {
+        "question": input.question,
+        "answer": answer,
+        "sources": sources,
+        "type": "question"
+    }
+
+    logs_inference.info({"user": user.username, "output": output})
+
+    return output
+
+
+def inferenceError(e):
+    try:
+        brain.semaphore.release()
+    except ValueError:
+        pass
+    logging.error(e)
+    traceback.print_tb(e.__traceback__)
+    return HTTPException(status_code=500, detail=str(e))
+
+
 @app.post("/projects/{projectName}/vision", response_model=QuestionResponse)
 def vision_project(
         projectName: str,
@@ -603,58 +630,50 @@ def vision_project(
 
         return output
     except Exception as e:
-        try:
-            brain.semaphore.release()
-        except ValueError:
-            pass
-        logging.error(e)
-        traceback.print_tb(e.__traceback__)
-        raise HTTPException(
-            status_code=500, detail=str(e))
+        raise inferenceError(e)
 
 
 @app.post("/projects/{projectName}/question", response_model=QuestionResponse)
-def question_project(
+async def question_project(
         projectName: str,
         input: QuestionModel,
         user: User = Depends(get_current_username_project),
         db: Session = Depends(get_db)):
     try:
-        answer, docs = brain.entryQuestion(projectName, input, db)
+        answer, docs = await brain.entryQuestion(projectName, input, db)
 
-        sources = [{"content": doc.page_content,
-                    "keywords": doc.metadata.get("keywords", ""),
-                    "source": doc.metadata.get("source", "")} for doc in docs]
+        return questionOutput(user, input, answer, docs)
+    except Exception as e:
+        raise inferenceError(e)
 
-        output = {
-            "question": input.question,
-            "answer": answer,
-            "sources": sources,
-            "type": "question"
-        }
 
-        logs_inference.info({"user": user.username, "output": output})
+@app.post("/projects/{projectName}/questions", response_model=list[QuestionResponse])
+async def questions_project(
+        projectName: str,
+        inputs: list[QuestionModel],
+        user: User = Depends(get_current_username_project),
+        db: Session = Depends(get_db)):
+    if len(inputs) > brain.maxQuestions:
+        raise HTTPException(
+            status_code=413, detail="Too many questions, the maximum is " + str(brain.maxQuestions))
 
-        return output
+    try:
+        results = await brain.entryQuestions(projectName, inputs, db)
+
+        return [questionOutput(user, input, answer, docs)
+                for input, (answer, docs) in zip(inputs, results)]
     except Exception as e:
-        try:
-            brain.semaphore.release()
-        except ValueError:
-            pass
-        logging.error(e)
-        traceback.print_tb(e.__traceback__)
-        raise HTTPException(
-            status_code=500, detail=str(e))
+        raise inferenceError(e)
 
 
 @app.post("/projects/{projectName}/chat", response_model=ChatResponse)
-def chat_project(
+async def chat_project(
         projectName: str,
         input: ChatModel,
         user: User = Depends(get_current_username_project),
         db: Session = Depends(get_db)):
     try:
-        chat, output = brain.entryChat(projectName, input, db)
+        chat, output = await brain.entryChat(projectName, input, db)
 
         docs = output["source_documents"]
         answer = output["answer"].strip()
@@ -674,14 +693,7 @@ def chat_project(
 
         return output
     except Exception as e:
-        try:
-            brain.semaphore.release()
-        except ValueError:
-            pass
-        logging.error(e)
-        traceback.print_tb(e.__traceback__)
-        raise HTTPException(
-            status_code=500, detail=str(e))
+        raise inferenceError(e)
 
 
 try:
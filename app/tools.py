@@ -1,36 +1,121 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import logging
+import math
+import multiprocessing
 import os
+import threading
 from fastapi import HTTPException
+from langchain_core.documents import Document
+import numpy as np
 from modules.loaders import LOADERS
-import yake
+from app.keywords import extractKeywords, initKeywordExtractor
 import re
 import torch
 
 
-def IndexDocuments(brain, project, documents):
-    docs = brain.text_splitter.split_documents(documents)
+def SplitDocuments(documents, chunk_size, chunk_overlap):
+    docs = []
+    for document in documents:
+        for chunk in SplitText(document.page_content, chunk_size, chunk_overlap):
+            docs.append(Document(page_content=chunk,
+                        metadata=dict(document.metadata)))
+    return docs
+
+
+def SplitText(text, chunk_size, chunk_overlap):
+    if len(text) == 0:
+        return []
+
+    codepoints = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+    spaces = np.flatnonzero(codepoints == 0x20)
+    bounds = np.concatenate(([0], spaces[spaces > 0], [len(text)]))
+    lengths = np.diff(bounds)
+
+    chunks = []
+    first = 0
+    for i in np.append(np.flatnonzero(lengths >= chunk_size), len(lengths)):
+        chunks.extend(_mergeSplits(
+            text, bounds[first:i + 1], chunk_size, chunk_overlap))
+        if i < len(lengths):
+            chunks.append(text[bounds[i]:bounds[i + 1]])
+        first = i + 1
+    return chunks
+
+
+def _mergeSplits(text, bounds, chunk_size, chunk_overlap):
+    count = len(bounds) - 1
+    if count <= 0:
+        return []
+
+    chunks = []
+    start = 0
+    while True:
+        end = int(np.searchsorted(
+            bounds, bounds[start] + chunk_size, side="right")) - 1
+        end = max(end, start + 1)
+
+        chunk = text[bounds[start]:bounds[end]].strip()
+        if chunk:
+            chunks.append(chunk)
+
+        if end >= count:
+            return chunks
+
+        overlap = int(np.searchsorted(
+            bounds, bounds[end] - chunk_overlap, side="left"))
+        fits = int(np.searchsorted(
+            bounds, bounds[end + 1] - chunk_size, side="left"))
+        start = min(end, max(start, overlap, fits))
+
 
-    texts = [doc.page_content for doc in docs]
-    metadatas = [doc.metadata for doc in docs]
- 
-    for metadata in metadatas:
-      for key, value in list(metadata.items()):
-          if key == 'languages' or value is None:
-              del metadata[key]
+KEYWORDS_PARALLEL_MIN_DOCS = 64
+KEYWORDS_MAX_WORKERS = int(os.environ.get("KEYWORDS_MAX_WORKERS", "4"))
 
-    ids = project.db.add_texts(texts=texts, metadatas=metadatas)
-    return ids
+_kw_executor = None
+_kw_executorLock = threading.Lock()
+
+
+def _getKeywordsExecutor():
+    global _kw_executor
+    with _kw_executorLock:
+        if _kw_executor is None:
+            # spawn, not fork: the server process holds torch/CUDA and tokenizer threads
+            _kw_executor = ProcessPoolExecutor(
+                max_workers=min(os.cpu_count(), KEYWORDS_MAX_WORKERS),
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=initKeywordExtractor)
+        return _kw_executor
+
+
+def _resetKeywordsExecutor(executor):
+    global _kw_executor
+    with _kw_executorLock:
+        if _kw_executor is executor:
+            _kw_executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
 
 
 def ExtractKeywordsForMetadata(documents):
-    max_ngram_size = 4
-    numOfKeywords = 15
-    kw_extractor = yake.KeywordExtractor(n=max_ngram_size, top=numOfKeywords)
-    for document in documents:
-        metadataKeywords = ""
-        keywords = kw_extractor.extract_keywords(document.page_content)
-        for kw in keywords:
-            metadataKeywords = metadataKeywords + kw[0] + ", "
+    texts = [document.page_content for document in documents]
+
+    results = None
+    if len(texts) >= KEYWORDS_PARALLEL_MIN_DOCS:
+        executor = _getKeywordsExecutor()
+        # one task per worker, so no more workers get spawned than there are texts
+        workers = min(os.cpu_count(), KEYWORDS_MAX_WORKERS, len(texts))
+        try:
+            results = list(executor.map(
+                extractKeywords, texts, chunksize=math.ceil(len(texts) / workers)))
+        except BrokenProcessPool as e:
+            # a worker died (e.g. OOM killed), start a fresh pool next time and finish this batch here
+            logging.error(e)
+            _resetKeywordsExecutor(executor)
+
+    if results is None:
+        results = [extractKeywords(text) for text in texts]
+
+    for document, metadataKeywords in zip(documents, results):
         document.metadata["keywords"] = metadataKeywords
 
     return documents
@@ -45,16 +130,28 @@ def FindFileLoader(filepath, ext, eargs={}):
         raise Exception("Invalid file type.")
 
 
-def FindEmbeddingsPath(projectName):
+_embeddingsPaths = {}
+_embeddingsDirPattern = re.compile(r'^(?P<name>.+)_[0-9]+$')
+
+
+def _scanEmbeddingsPaths():
     embeddings_path = os.environ["EMBEDDINGS_PATH"]
-    project_dirs = [d for d in os.listdir(
-        embeddings_path) if os.path.isdir(os.path.join(embeddings_path, d))]
+    for dir in os.listdir(embeddings_path):
+        match = _embeddingsDirPattern.match(dir)
+        if match and os.path.isdir(os.path.join(embeddings_path, dir)):
+            _embeddingsPaths.setdefault(
+                match.group("name"), os.path.join(embeddings_path, dir))
+
+
+def FindEmbeddingsPath(projectName):
+    if projectName not in _embeddingsPaths:
+        _scanEmbeddingsPaths()
+
+    return _embeddingsPaths.get(projectName)
 
-    for dir in project_dirs:
-        if re.match(f'^{projectName}_[0-9]+$', dir):
-            return os.path.join(embeddings_path, dir)
 
-    return None
+def InvalidateEmbeddingsPath(projectName):
+    _embeddingsPaths.pop(projectName, None)
 
 
 def loadEnvVars():
@@ -1,27 +1,118 @@
 import os
 import shutil
+import uuid
 from langchain.vectorstores import Chroma, FAISS, Redis
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+import numpy as np
 import redis
 
-from app.tools import FindEmbeddingsPath
+from app.tools import FindEmbeddingsPath, InvalidateEmbeddingsPath, SplitDocuments
+
+REDIS_SCAN_COUNT = 1000
+CHROMA_PAGE_SIZE = 5000
+
+_URL_PREFIXES = ('http://', 'https://')
+
+_redis_pool = None
+
+
+def _get_redis():
+    global _redis_pool
+    if _redis_pool is None:
+        _redis_pool = redis.BlockingConnectionPool(
+            host=os.environ["REDIS_HOST"],
+            port=int(os.environ["REDIS_PORT"]),
+            decode_responses=True,
+            max_connections=32)
+    return redis.Redis(connection_pool=_redis_pool)
+
+
+def _redis_scan(lredis, prefix):
+    keys = []
+    for key in lredis.scan_iter(match=prefix + "*", count=REDIS_SCAN_COUNT):
+        keys.append(key)
+        if len(keys) >= REDIS_SCAN_COUNT:
+            yield keys
+            keys = []
+    if keys:
+        yield keys
+
+
+def _redis_scan_fields(lredis, prefix, *fields):
+    for keys in _redis_scan(lredis, prefix):
+        pipe = lredis.pipeline(transaction=False)
+        for key in keys:
+            pipe.hmget(key, fields)
+        yield from zip(keys, pipe.execute())
+
+
+def _chroma_metadatas(collection):
+    offset = 0
+    while True:
+        page = collection.get(
+            include=["metadatas"], limit=CHROMA_PAGE_SIZE, offset=offset)
+        if not page["metadatas"]:
+            break
+        yield from page["metadatas"]
+        offset += CHROMA_PAGE_SIZE
+
+
+def _hnsw_params(count):
+    if count < 10000:
+        return {"m": 16, "ef_construction": 128, "ef_search": 64}
+    elif count < 1000000:
+        return {"m": 24, "ef_construction": 128, "ef_search": 100}
+    else:
+        return {"m": 32, "ef_construction": 200, "ef_search": 128}
+
+
+def vector_faiss_index(dimension):
+    import faiss
+
+    params = _hnsw_params(0)
+    index = faiss.IndexHNSWSQ(
+        dimension, faiss.ScalarQuantizer.QT_fp16, params["m"])
+    index.hnsw.efConstruction = params["ef_construction"]
+    index.hnsw.efSearch = params["ef_search"]
+    return index
+
+
+def _faiss_init(embedding):
+    from langchain.docstore.in_memory import InMemoryDocstore
+
+    # The index is built by vector_add once the first vectors give its dimension.
+    return FAISS(
+        embedding_function=embedding,
+        index=None,
+        docstore=InMemoryDocstore(),
+        index_to_docstore_id={})
 
 
 def vector_init(brain, project):
     path = FindEmbeddingsPath(project.model.name)
 
     if project.model.vectorstore == "chroma":
+        collection_metadata = None
+        if path is None or len(os.listdir(path)) == 0:
+            params = _hnsw_params(0)
+            collection_metadata = {
+                "hnsw:M": params["m"],
+                "hnsw:construction_ef": params["ef_construction"],
+                "hnsw:search_ef": params["ef_search"]}
         return Chroma(
             persist_directory=path, embedding_function=brain.getEmbedding(
-                project.model.embeddings))
+                project.model.embeddings),
+            collection_metadata=collection_metadata)
     elif project.model.vectorstore == "faiss":
         if path is None or len(os.listdir(path)) == 0:
-            return FAISS(embedding_function=brain.getEmbedding(
-                project.model.embeddings))
+            return _faiss_init(brain.getEmbedding(project.model.embeddings))
         else:
             return vector_load(brain, project)
     elif project.model.vectorstore == "redis":
         if path is None or len(os.listdir(path)) == 0:
             schema = {'text': [{'name': 'source'}, {'name': 'keywords'}]}
+            params = _hnsw_params(0)
             return Redis(
                 redis_url="redis://" +
                 os.environ["REDIS_HOST"] +
@@ -30,15 +121,21 @@ def vector_init(brain, project):
                 index_name=project.model.name,
                 embedding=brain.getEmbedding(
                     project.model.embeddings),
-                index_schema=schema)
+                index_schema=schema,
+                vector_schema={
+                    "algorithm": "HNSW",
+                    "m": params["m"],
+                    "ef_construction": params["ef_construction"],
+                    "ef_runtime": params["ef_search"]})
         else:
             return vector_load(brain, project)
 
 
 def vector_save(project):
     if project.model.vectorstore == "faiss":
-        project.db.save_local(FindEmbeddingsPath(
-            project.model.name))
+        if project.db.index is not None:
+            project.db.save_local(FindEmbeddingsPath(
+                project.model.name))
     elif project.model.vectorstore == "chroma":
         project.db.persist()
     elif project.model.vectorstore == "redis":
@@ -48,9 +145,13 @@ def vector_save(project):
 
 def vector_load(brain, project):
     if project.model.vectorstore == "faiss":
-        return FAISS.load_local(FindEmbeddingsPath(
+        db = FAISS.load_local(FindEmbeddingsPath(
             project.model.name), brain.getEmbedding(
             project.model.embeddings))
+        if hasattr(db.index, "hnsw"):
+            db.index.hnsw.efSearch = _hnsw_params(
+                db.index.ntotal)["ef_search"]
+        return db
     elif project.model.vectorstore == "redis":
         return Redis.from_existing_index(
             brain.getEmbedding(
@@ -65,72 +166,76 @@ def vector_load(brain, project):
             "/schema.yaml")
 
 
+def vector_add(project, texts, vectors, metadatas):
+    if project.model.vectorstore == "chroma":
+        ids = [str(uuid.uuid1()) for _ in texts]
+        project.db._collection.upsert(
+            ids=ids, embeddings=vectors, metadatas=metadatas, documents=texts)
+    elif project.model.vectorstore == "faiss":
+        if project.db.index is None:
+            project.db.index = vector_faiss_index(len(vectors[0]))
+        ids = project.db.add_embeddings(
+            text_embeddings=list(zip(texts, vectors)), metadatas=metadatas)
+    elif project.model.vectorstore == "redis":
+        ids = project.db.add_texts(
+            texts=texts, metadatas=metadatas, embeddings=vectors)
+    return ids
+
+
+def IndexDocuments(brain, project, documents):
+    docs = SplitDocuments(documents, brain.chunkSize, brain.chunkOverlap)
+
+    texts = [doc.page_content for doc in docs]
+    metadatas = [{key: value for key, value in doc.metadata.items()
+                  if key != 'languages' and value is not None} for doc in docs]
+
+    if len(texts) == 0:
+        return []
+
+    vectors = project.db.embeddings.embed_documents(texts)
+
+    return vector_add(project, texts, vectors, metadatas)
+
+
 def vector_list(project, type="all"):
-    urls = []
-    files = []
-    other = []
+    urls = {}
+    other = {}
     if project.model.vectorstore == "chroma":
         collection = project.db._client.get_collection("langchain")
+        sources = (metadata["source"]
+                   for metadata in _chroma_metadatas(collection))
+    elif project.model.vectorstore == "redis":
+        lredis = _get_redis()
+        sources = (source for key, (source,) in _redis_scan_fields(
+            lredis, project.db.key_prefix, "source"))
+    else:
+        sources = ()
 
-        docs = collection.get(
-            include=["metadatas"]
-        )
-
-        for metadata in docs["metadatas"]:
-            if type == "url" or type == "urls":
-                if metadata["source"].startswith(
-                        ('http://', 'https://')) and metadata["source"] not in urls:
-                    urls.append(metadata["source"])
-            elif type == "other":
-                if not metadata["source"].startswith(
-                        ('http://', 'https://')) and metadata["source"] not in other:
-                    other.append(metadata["source"])
-            elif type == "all":
-                if metadata["source"].startswith(
-                        ('http://', 'https://')) and metadata["source"] not in urls:
-                    urls.append(metadata["source"])
-                if not metadata["source"].startswith(
-                        ('http://', 'https://')) and metadata["source"] not in other:
-                    other.append(metadata["source"])
+    if type == "url" or type == "urls":
+        for source in sources:
+            if source.startswith(_URL_PREFIXES):
+                urls[source] = None
+    elif type == "other" or type == "others":
+        for source in sources:
+            if not source.startswith(_URL_PREFIXES):
+                other[source] = None
+    elif type == "all":
+        for source in sources:
+            (urls if source.startswith(_URL_PREFIXES) else other)[source] = None
 
-    elif project.model.vectorstore == "redis":
-        lredis = redis.Redis(
-            host=os.environ["REDIS_HOST"],
-            port=os.environ["REDIS_PORT"],
-            decode_responses=True)
-        keys = lredis.keys(project.db.key_prefix + "*")
-        for key in keys:
-            source = lredis.hget(key, "source")
-            if type == "url" or type == "urls":
-                if source.startswith(
-                        ('http://', 'https://')) and source not in urls:
-                    urls.append(source)
-            elif type == "other" or type == "others":
-                if not source.startswith(
-                        ('http://', 'https://')) and source not in other:
-                    other.append(source)
-            elif type == "all":
-                if source.startswith(
-                        ('http://', 'https://')) and source not in urls:
-                    urls.append(source)
-                if not source.startswith(
-                        ('http://', 'https://')) and source not in other:
-                    other.append(source)
-
-    return {"urls": urls, "other": other}
+    return {"urls": list(urls), "other": list(other)}
 
 
 def vector_info(project):
     if project.model.vectorstore == "chroma":
-        dbInfo = project.db.get()
-        return len(dbInfo["documents"]), len(dbInfo["metadatas"])
+        count = project.db._collection.count()
+        return count, count
     elif project.model.vectorstore == "redis":
-        lredis = redis.Redis(
-            host=os.environ["REDIS_HOST"],
-            port=os.environ["REDIS_PORT"],
-            decode_responses=True)
-        keys = lredis.keys(project.db.key_prefix + "*")
-        return len(keys), len(keys)
+        lredis = _get_redis()
+        count = 0
+        for keys in _redis_scan(lredis, project.db.key_prefix):
+            count += len(keys)
+        return count, count
 
 
 def vector_find(project, source):
@@ -139,27 +244,78 @@ def vector_find(project, source):
         collection = project.db._client.get_collection("langchain")
         docs = collection.get(where={'source': source})
     elif project.model.vectorstore == "redis":
-        lredis = redis.Redis(
-            host=os.environ["REDIS_HOST"],
-            port=os.environ["REDIS_PORT"],
-            decode_responses=True)
-        keys = lredis.keys(project.db.key_prefix + "*")
+        lredis = _get_redis()
         ids = []
         metadatas = []
         documents = []
-        for key in keys:
-            lsource = lredis.hget(key, "source")
+        for key, (lsource, keywords, content) in _redis_scan_fields(
+                lredis, project.db.key_prefix, "source", "keywords", "content"):
             if lsource == source:
                 ids.append(key)
                 metadatas.append(
-                    {"source": lsource, "keywords": lredis.hget(key, "keywords")})
-                documents.append(lredis.hget(key, "content"))
+                    {"source": lsource, "keywords": keywords})
+                documents.append(content)
 
         docs = {"ids": ids, "metadatas": metadatas, "documents": documents}
 
     return docs
 
 
+class _EmptyRetriever(BaseRetriever):
+    def _get_relevant_documents(self, query, *, run_manager):
+        return []
+
+
+def vector_retriever(project, k, score):
+    if project.model.vectorstore == "faiss" and project.db.index is None:
+        # nothing indexed yet, FAISS can't search without an index
+        return _EmptyRetriever()
+
+    return project.db.as_retriever(
+        search_type="similarity_score_threshold",
+        search_kwargs={"score_threshold": score, "k": k})
+
+
+def vector_search(project, questions, k):
+    relevance = project.db._select_relevance_score_fn()
+
+    if project.model.vectorstore == "chroma":
+        vectors = [project.db.embeddings.embed_query(question) for question in questions]
+        results = project.db._collection.query(
+            query_embeddings=vectors,
+            n_results=k,
+            include=["documents", "metadatas", "distances"])
+        return [[(Document(page_content=document, metadata=metadata or {}), relevance(distance))
+                 for document, metadata, distance in zip(documents, metadatas, distances)]
+                for documents, metadatas, distances in zip(
+                    results["documents"], results["metadatas"], results["distances"])]
+    elif project.model.vectorstore == "faiss":
+        import faiss
+
+        if project.db.index is None:
+            return [[] for _ in questions]
+
+        vectors = np.array([project.db.embeddings.embed_query(question)
+                            for question in questions], dtype=np.float32)
+        if project.db._normalize_L2:
+            faiss.normalize_L2(vectors)
+        distances, indices = project.db.index.search(vectors, k)
+        batches = []
+        for rowDistances, rowIndices in zip(distances, indices):
+            batch = []
+            for distance, i in zip(rowDistances, rowIndices):
+                if i == -1:
+                    continue
+                document = project.db.docstore.search(
+                    project.db.index_to_docstore_id[i])
+                batch.append((document, relevance(distance)))
+            batches.append(batch)
+        return batches
+    else:
+        return [project.db.similarity_search_with_relevance_scores(question, k=k)
+                for question in questions]
+
+
 def vector_delete(project):
     if project.model.vectorstore == "chroma":
         try:
@@ -178,6 +334,8 @@ def vector_delete(project):
         except BaseException:
             pass
 
+    InvalidateEmbeddingsPath(project.model.name)
+
 
 def vector_delete_source(project, source):
     ids = []
@@ -187,17 +345,18 @@ def vector_delete_source(project, source):
         if len(ids):
             collection.delete(ids)
     elif project.model.vectorstore == "redis":
-        lredis = redis.Redis(
-            host=os.environ["REDIS_HOST"],
-            port=os.environ["REDIS_PORT"],
-            decode_responses=True)
-        keys = lredis.keys(project.db.key_prefix + "*")
-        for key in keys:
-            lsource = lredis.hget(key, "source")
+        lredis = _get_redis()
+        for key, (lsource,) in _redis_scan_fields(
+                lredis, project.db.key_prefix, "source"):
             if lsource == source or lsource == os.path.join(
                     os.environ["UPLOADS_PATH"], project.model.name, source):
                 ids.append(key)
-                lredis.delete(key)
+
+        for i in range(0, len(ids), REDIS_SCAN_COUNT):
+            pipe = lredis.pipeline(transaction=False)
+            for key in ids[i:i + REDIS_SCAN_COUNT]:
+                pipe.delete(key)
+            pipe.execute()
     return ids
 
 
@@ -208,10 +367,7 @@ def vector_delete_id(project, id):
         if len(ids):
             collection.delete(ids)
     elif project.model.vectorstore == "redis":
-        lredis = redis.Redis(
-            host=os.environ["REDIS_HOST"],
-            port=os.environ["REDIS_PORT"],
-            decode_responses=True)
+        lredis = _get_redis()
         lredis.delete(id)
     return id
 
@@ -1,7 +1,8 @@
 import uvicorn
 
-from app.main import app
-
 
 if __name__ == "__main__":
+    # imported here so the keyword worker processes, which re-import this file, don't build the app
+    from app.main import app
+
     uvicorn.run(app, host="0.0.0.0", port=9000)
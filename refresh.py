@@ -4,7 +4,8 @@ from time import sleep
 
 import chromadb
 from app.brain import Brain
-from app.tools import FindFileLoader, IndexDocuments
+from app.tools import FindFileLoader
+from app.vectordb import IndexDocuments
 
 if "EMBEDDINGS_PATH" not in os.environ:
     os.environ["EMBEDDINGS_PATH"] = "./embeddings/"
@@ -98,6 +98,52 @@ def test_questionProject():
     assert response.json()["answer"] == "The secret is that ingenuity should be bigger than politics and corporate greed."
 
 
+def test_questionsProject():
+    response = client.post("/projects/test_openai/questions",
+                           json=[{"question": "What is the secret?"}, {"question": "What is the secret?", "k": 2}], auth=("admin", "admin"))
+    assert response.status_code == 200
+    assert len(response.json()) == 2
+    assert response.json()[0]["answer"] == "The secret is that ingenuity should be bigger than politics and corporate greed."
+
+
+def test_questionsProjectEmpty():
+    response = client.post("/projects/test_openai/questions",
+                           json=[], auth=("admin", "admin"))
+    assert response.status_code == 200
+    assert response.json() == []
+
+
+def test_questionsProjectTooMany():
+    response = client.post("/projects/test_openai/questions",
+                           json=[{"question": "What is the secret?"}] * 33, auth=("admin", "admin"))
+    assert response.status_code == 413
+
+
+def test_createProjectSandboxed():
+    response = client.post(
+        "/projects", json={"name": "test_openai3",  "embeddings": "openai", "llm": "openai", "sandboxed": True}, auth=("admin", "admin"))
+    assert response.status_code == 200
+
+    response = client.patch(
+        "/projects/test_openai3", json={"llm": "openai", "sandboxed": True, "sandbox_project": "test_openai"}, auth=("admin", "admin"))
+    assert response.status_code == 200
+
+
+def test_questionsProjectSandboxed():
+    response = client.post("/projects/test_openai3/questions",
+                           json=[{"question": "What is the secret?"}] * 12, auth=("admin", "admin"))
+    assert response.status_code == 200
+    assert len(response.json()) == 12
+    for output in response.json():
+        assert output["answer"] == "The secret is that ingenuity should be bigger than politics and corporate greed."
+
+
+def test_deleteProjectSandboxed():
+    response = client.delete("/projects/test_openai3", auth=("admin", "admin"))
+    assert response.status_code == 200
+    assert response.json() == {"project": "test_openai3"}
+
+
 def test_questionProject2():
     response = client.post("/projects/test_openai2/question",
                            json={"question": "What is the secret?"}, auth=("admin", "admin"))
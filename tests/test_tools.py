@@ -0,0 +1,32 @@
+import random
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from app.tools import SplitText
+
+
+def splitReference(text, chunk_size, chunk_overlap):
+    return RecursiveCharacterTextSplitter(
+        separators=[" "], chunk_size=chunk_size, chunk_overlap=chunk_overlap).split_text(text)
+
+
+def test_splitTextEdgeCases():
+    for text in ["", " ", "   ", "word", " word", "word ", "a  b   c", "x" * 50 + " y"]:
+        assert SplitText(text, 5, 1) == splitReference(text, 5, 1)
+
+
+def test_splitTextMatchesLangChain():
+    rng = random.Random(42)
+    for _ in range(500):
+        chunk_size = rng.choice([5, 20, 50, 100, 1024])
+        chunk_overlap = rng.choice([0, 1, 5, 10, 30])
+        if chunk_overlap >= chunk_size:
+            continue
+
+        words = ["".join(rng.choice("abcdéfgh\n😀") for _ in range(rng.choice([0, 1, 3, 8, 15, 60, 1100])))
+                 for _ in range(rng.randint(0, 200))]
+        text = rng.choice(["", " ", "  "]) + \
+            "".join(word + rng.choice([" ", " ", "  ", "   "]) for word in words)
+
+        assert SplitText(text, chunk_size, chunk_overlap) == splitReference(
+            text, chunk_size, chunk_overlap)